@@ -2,41 +2,217 @@
 import os
 import re
 import csv
-from collections import Counter, defaultdict
-from typing import Dict, Tuple, List, Optional
-
-from fastapi import FastAPI
+import hashlib
+import pickle
+import shutil
+import asyncio
+import tempfile
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Dict, Tuple, List, Optional, Union
+
+import ahocorasick
+import numpy as np
+import orjson
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # Config
 MODEL_ID = os.getenv("EMOTION_MODEL", "j-hartmann/emotion-english-distilroberta-base")
+# Opt-in (needs requirements-onnx.txt): INT8 labels have not been validated against the fp32 pipeline yet
+USE_ONNX = os.getenv("EMOTION_ONNX", "0") == "1"
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(__file__), "data", "onnx-int8")
+)
 GITLAB_VAD_PATH = os.getenv(
     "GITLAB_VAD_PATH",
     os.path.join(os.path.dirname(__file__), "data", "vad_gitlab.csv")
 )
+GITLAB_VAD_CACHE = os.getenv("GITLAB_VAD_CACHE", GITLAB_VAD_PATH + ".pkl")
+GITLAB_VAD_VALUES = os.getenv("GITLAB_VAD_VALUES", GITLAB_VAD_PATH + ".npy")  # (3, N) float64, memory-mapped
+MAX_BATCH = int(os.getenv("HF_MAX_BATCH", "16"))
+MAX_WAIT_MS = float(os.getenv("HF_MAX_WAIT_MS", "5"))
+EMOTION_CACHE_SIZE = 4096
+# Skip the HF model when lexicon phrases cover at least this share of the input tokens (>1 disables)
+VAD_COVERAGE_SKIP_HF = float(os.getenv("VAD_COVERAGE_SKIP_HF", "0.3"))
 
 # FastAPI
-app = FastAPI(title="MoodQuiz")
+app = FastAPI(title="MoodQuiz", default_response_class=ORJSONResponse)
 
+# Request body schema; only used for the OpenAPI docs, infer_text parses the body by hand
 class TextIn(BaseModel):
     text: str
 
 # Lazy HuggingFace pipeline 
 _hf_pipeline = None
+_hf_lock = threading.Lock()  # startup warmup thread and request path may race to build it
+
+def _onnx_pipeline():
+    """
+    HF pipeline over an INT8 dynamically-quantized ONNX Runtime export of MODEL_ID.
+    The export + quantization runs once and is moved into ONNX_MODEL_DIR as a whole,
+    so concurrent workers never load a partly written model.
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer, pipeline
+
+    quantized = "model_quantized.onnx"
+    if not os.path.exists(os.path.join(ONNX_MODEL_DIR, quantized)):
+        parent = os.path.dirname(os.path.abspath(ONNX_MODEL_DIR))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".onnx-export-", dir=parent)
+        try:
+            fp32 = ORTModelForSequenceClassification.from_pretrained(MODEL_ID, export=True)
+            quantizer = ORTQuantizer.from_pretrained(fp32)
+            # reduce_range avoids U8S8 saturation on AVX2 / non-VNNI CPUs
+            qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False, reduce_range=True)
+            quantizer.quantize(save_dir=tmp, quantization_config=qconfig)
+            os.replace(tmp, ONNX_MODEL_DIR)
+        except OSError:
+            if not os.path.exists(os.path.join(ONNX_MODEL_DIR, quantized)):
+                raise
+            # another worker published its export first; use that one
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    ort_model = ORTModelForSequenceClassification.from_pretrained(ONNX_MODEL_DIR, file_name=quantized)
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+    return pipeline("text-classification", model=ort_model, tokenizer=tokenizer, top_k=None)
 
 def get_pipeline():
-    """Lazy-create HF emotion classifier. Returns None if transformers not available."""
+    """
+    Lazy-create HF emotion classifier, preferring the ONNX Runtime INT8 model.
+    Falls back to the plain transformers pipeline; returns None if neither is available.
+    """
     global _hf_pipeline
     if _hf_pipeline is not None:
         return _hf_pipeline
-    try:
-        from transformers import pipeline
-        # top_k=None is the new way to get all scores (return_all_scores is deprecated)
-        _hf_pipeline = pipeline("text-classification", model=MODEL_ID, top_k=None)
-    except Exception:
-        _hf_pipeline = None
+    with _hf_lock:
+        if _hf_pipeline is not None:
+            return _hf_pipeline
+        if USE_ONNX:
+            try:
+                _hf_pipeline = _onnx_pipeline()
+                return _hf_pipeline
+            except Exception:
+                _hf_pipeline = None
+        try:
+            from transformers import pipeline
+            # top_k=None is the new way to get all scores (return_all_scores is deprecated)
+            _hf_pipeline = pipeline("text-classification", model=MODEL_ID, top_k=None)
+        except Exception:
+            _hf_pipeline = None
     return _hf_pipeline
 
+def _normalize_text(text: str) -> str:
+    # Collapse whitespace only; the classifier is cased, so keep the original casing.
+    return " ".join(text.split())
+
+EmotionScores = Tuple[Tuple[str, float], ...]
+
+def _scores_from_output(scores) -> EmotionScores:
+    # list containing dictionaries[{"label": "joy", "score": 0.8}, ...]
+    return tuple((s["label"].lower(), float(s["score"])) for s in scores)
+
+class BatchRunner:
+    """
+    Coalesce concurrent classifier calls into one batched pipeline call.
+    Drains up to max_batch queued texts, waiting at most max_wait_ms for more to arrive.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, text: str) -> EmotionScores:
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)  # requests queued meanwhile form the next batch
+
+    async def _flush(self, batch: List[Tuple[str, "asyncio.Future"]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            # Model load and forward pass are blocking; keep them off the event loop
+            results = await asyncio.get_running_loop().run_in_executor(None, self._classify, texts)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), res in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(res, Exception):
+                fut.set_exception(res)
+            else:
+                fut.set_result(res)
+
+    @staticmethod
+    def _classify(texts: List[str]) -> List[Union[EmotionScores, Exception]]:
+        nlp = get_pipeline()
+        if nlp is None:
+            return [()] * len(texts)
+        try:
+            out = nlp(texts, batch_size=len(texts), truncation=True, padding=True)
+            return [_scores_from_output(scores) for scores in out]
+        except Exception:
+            if len(texts) == 1:
+                raise
+        # One bad input must not fail the whole batch; retry each text on its own
+        results: List[Union[EmotionScores, Exception]] = []
+        for text in texts:
+            try:
+                results.append(_scores_from_output(nlp([text], truncation=True)[0]))
+            except Exception as e:
+                results.append(e)
+        return results
+
+batch_runner = BatchRunner()
+
+# LRU of normalized-text fingerprint -> emotion scores, checked before queueing for the model.
+# Keyed by a 16-byte digest so cached entries never hold on to client text.
+_emotion_cache: "OrderedDict[bytes, EmotionScores]" = OrderedDict()
+
+async def _emotions_for(text_norm: str) -> EmotionScores:
+    """Cached HF emotion scores for a normalized text, as hashable (label, score) pairs."""
+    key = hashlib.blake2b(text_norm.encode(), digest_size=16).digest()
+    cached = _emotion_cache.get(key)
+    if cached is not None:
+        _emotion_cache.move_to_end(key)
+        return cached
+    scores = await batch_runner.submit(text_norm)
+    if scores:  # don't pin an empty result while the model is unavailable
+        _emotion_cache[key] = scores
+        if len(_emotion_cache) > EMOTION_CACHE_SIZE:
+            _emotion_cache.popitem(last=False)
+    return scores
+
 # Emotion to Music mapping (fallback / blend component)
 
 EMOTION_TO_MOOD: Dict[str, Dict[str, float]] = {
@@ -54,42 +230,115 @@ EMOTION_TO_MOOD: Dict[str, Dict[str, float]] = {
     "neutral":    {"valence": 0.5,  "energy": 0.5, "focus": 0.5, "danceability": 0.5, "tempo_pref": 0.5},
 }
 DEFAULT_MOOD = {"valence":0.5, "energy":0.5, "focus":0.5, "danceability":0.5, "tempo_pref":0.5}
+DIMS = tuple(DEFAULT_MOOD)
+DEFAULT_VEC = np.array([DEFAULT_MOOD[d] for d in DIMS], dtype=np.float64)
+
+# Same mapping as a (num_emotions, 5) matrix so aggregation is one matmul
+EMOTION_LABELS = list(EMOTION_TO_MOOD)
+EMOTION_IDX = {label: i for i, label in enumerate(EMOTION_LABELS)}
+MOOD_MATRIX = np.array([[EMOTION_TO_MOOD[l][d] for d in DIMS] for l in EMOTION_LABELS], dtype=np.float64)
 
-def blend_moods(a: Dict[str,float], b: Dict[str,float], wa: float = 0.5) -> Dict[str,float]:
-    """Linear blend of two mood dicts with weight 'wa' for 'a' (and 1-wa for 'b')."""
-    wb = 1.0 - wa
-    out = {}
-    for k in DEFAULT_MOOD.keys():
-        out[k] = round((a.get(k,0.5)*wa) + (b.get(k,0.5)*wb), 4)
-    return out
+def _round4(vec: np.ndarray) -> np.ndarray:
+    # Python round() per element: np.round scales by 1e4 first and breaks 5th-decimal ties differently
+    return np.array([round(x, 4) for x in vec.tolist()], dtype=np.float64)
+
+def _blend_np(a_vec: np.ndarray, b_vec: np.ndarray, wa: float = 0.5) -> np.ndarray:
+    """Linear blend of two mood vectors with weight 'wa' for 'a' (and 1-wa for 'b')."""
+    return _round4(wa*a_vec + (1.0 - wa)*b_vec)
 
 # VAD (GitLab phrases and terms) loader and matcher
 #   File value range is: [-1, 1]. We're gonna normalize it to [0, 1]
-#   Longest-phrase-first n-gram matching (up to 4-grams)
+#   Longest-phrase-first n-gram matching (up to 4-grams) via one Aho-Corasick pass.
+#   Lexicon tokens are interned to int ids and the automaton runs over id sequences,
+#   so hits always land on token boundaries and no strings are built per request.
 
 _word_re = re.compile(r"[a-z']+")  # keep apostrophes
-
-def tokenize(text: str) -> List[str]:
-    return [w.lower() for w in _word_re.findall(text.lower())]
-
-_term_dict: Dict[str, Tuple[float,float,float]] = {}
-_index_by_first: Dict[str, Dict[int, Dict[Tuple[str,...], Tuple[float,float,float]]]] = {}
+_find_words = _word_re.findall     # bound once; saves an attribute lookup per call
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    # One lowercase pass; the regex only yields [a-z'] so matches need no further casing
+    return tuple(_find_words(text.lower()))
+
+_vad_loaded = False
+_tok2id: Dict[str, int] = {}  # 0 is reserved for tokens outside the lexicon
+_automaton: Optional[ahocorasick.Automaton] = None  # (id_a, id_b) -> phrase id << 3 | L
+# VAD values as parallel float64 arrays indexed by phrase id (float32 would shift the rounded output)
+_V = _A = _D = np.empty(0, dtype=np.float64)
+_L = np.empty(0, dtype=np.uint8)  # phrase length in tokens
 _max_ngram = 4  # up to 4-word phrases
+_VAD_CACHE_MAX_CHARS = 1024  # longer inputs skip the scan cache so it never pins large client text
+_VAD_CACHE_VERSION = 4  # bump when the pickled layout changes
 
 def _norm01(x: float) -> float:
     # Input in [-1, 1] and output in [0, 1]
     return max(0.0, min(1.0, (x + 1.0) / 2.0))
 
+def _load_vad_cache(path: str) -> bool:
+    """
+    Load the pickled matcher and the memory-mapped V/A/D values if both are at least as new as the CSV.
+    Workers mapping the same values file share its pages instead of each holding a copy.
+    """
+    global _tok2id, _automaton, _V, _A, _D, _L
+    try:
+        csv_mtime = os.path.getmtime(path)
+        if min(os.path.getmtime(GITLAB_VAD_CACHE), os.path.getmtime(GITLAB_VAD_VALUES)) < csv_mtime:
+            return False
+        with open(GITLAB_VAD_CACHE, "rb") as f:
+            state = pickle.load(f)
+        values = np.load(GITLAB_VAD_VALUES, mmap_mode="r")
+    except Exception:
+        return False
+    if not isinstance(state, tuple) or state[0] != _VAD_CACHE_VERSION:
+        return False
+    if values.shape != (3, len(state[-1])):
+        return False
+    _, _tok2id, _automaton, _L = state
+    _V, _A, _D = values
+    return True
+
+def _atomic_write(dest: str, write) -> None:
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, dest)  # atomic, so other workers never read a partial file
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def _save_vad_cache() -> None:
+    # Values first: a fresh pickle implies a matching values file
+    _atomic_write(GITLAB_VAD_VALUES, lambda f: np.save(f, np.stack([_V, _A, _D])))
+    state = (_VAD_CACHE_VERSION, _tok2id, _automaton, _L)
+    _atomic_write(GITLAB_VAD_CACHE, lambda f: pickle.dump(state, f, protocol=5))
+
+def _build_automaton(phrase_pid: Dict[str, int], tok2id: Dict[str, int]):
+    # Plain C ints as values (no per-phrase Python objects), so the pickled cache loads faster
+    automaton = ahocorasick.Automaton(ahocorasick.STORE_INTS, ahocorasick.KEY_SEQUENCE)
+    for phrase, pid in phrase_pid.items():
+        ids = tuple(tok2id[t] for t in phrase.split(" "))
+        automaton.add_word(ids, (pid << 3) | len(ids))  # L <= _max_ngram fits in 3 bits
+    if len(automaton):
+        automaton.make_automaton()
+    return automaton
+
 def load_gitlab_vad() -> None:
-    """Load GitLab VAD lexicon once into memory."""
-    global _term_dict, _index_by_first
-    if _term_dict:
+    """Load GitLab VAD lexicon once into memory, preferring the pickled cache over the CSV."""
+    global _vad_loaded, _tok2id, _automaton, _V, _A, _D, _L
+    if _vad_loaded:
         return
 
-    term_dict: Dict[str, Tuple[float,float,float]] = {}
-    index_by_first: Dict[str, Dict[int, Dict[Tuple[str,...], Tuple[float,float,float]]]] = defaultdict(lambda: defaultdict(dict))
-
     path = GITLAB_VAD_PATH
+    if _load_vad_cache(path):
+        _vad_loaded = True
+        return
+
+    tok2id: Dict[str, int] = {}
+    phrase_pid: Dict[str, int] = {}
+    vs: List[float] = []; as_: List[float] = []; ds: List[float] = []; ls: List[int] = []
+
     with open(path, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f, delimiter=',')
         # Expected headers: term,valence,arousal,dominance
@@ -107,17 +356,27 @@ def load_gitlab_vad() -> None:
             except Exception:
                 continue
 
-            v01 = _norm01(v); a01 = _norm01(a); d01 = _norm01(d)
-            key = " ".join(toks)
-            term_dict[key] = (v01, a01, d01)
-
-            first = toks[0]
             L = len(toks)
-            if L <= _max_ngram:
-                index_by_first[first][L][tuple(toks)] = (v01, a01, d01)
-
-    _term_dict = term_dict
-    _index_by_first = index_by_first
+            if L > _max_ngram:
+                continue  # never matched; don't spend memory on it
+            for t in toks:
+                tok2id.setdefault(t, len(tok2id) + 1)
+            key = " ".join(toks)
+            pid = phrase_pid.get(key)
+            if pid is None:
+                phrase_pid[key] = len(vs)
+                vs.append(_norm01(v)); as_.append(_norm01(a)); ds.append(_norm01(d)); ls.append(L)
+            else:  # duplicate phrase: last row wins
+                vs[pid] = _norm01(v); as_[pid] = _norm01(a); ds[pid] = _norm01(d)
+
+    _tok2id = tok2id
+    _automaton = _build_automaton(phrase_pid, tok2id)
+    _V = np.array(vs, dtype=np.float64)
+    _A = np.array(as_, dtype=np.float64)
+    _D = np.array(ds, dtype=np.float64)
+    _L = np.array(ls, dtype=np.uint8)
+    _vad_loaded = True
+    _save_vad_cache()
 
 def vad_from_text_gitlab(text: str) -> Optional[Tuple[float,float,float]]:
     """
@@ -126,131 +385,161 @@ def vad_from_text_gitlab(text: str) -> Optional[Tuple[float,float,float]]:
     Allow multiple matches; weight by frequency.
     Returns (V,A,D) in [0,1], or None if no matches.
     """
+    return vad_with_coverage(text)[0]
+
+def vad_with_coverage(text: str) -> Tuple[Optional[Tuple[float,float,float]], float]:
+    """Like vad_from_text_gitlab, plus the share of input tokens covered by matched phrases."""
     load_gitlab_vad()
-    toks = tokenize(text)
+    # Texts differing only in casing/punctuation share a cache entry
+    text_norm = " ".join(tokenize(text))
+    if len(text_norm) > _VAD_CACHE_MAX_CHARS:
+        return _vad_cached.__wrapped__(text_norm)
+    return _vad_cached(text_norm)
+
+def _scan_automaton(toks: List[str]) -> List[int]:
+    """Phrase ids of the greedy longest-first matches, via the Aho-Corasick automaton."""
+    if _automaton.kind != ahocorasick.AHOCORASICK:
+        return []  # empty lexicon
     n = len(toks)
-    if n == 0:
-        return None
-    counts = Counter()   # if matched term, then count
-    matches: List[Tuple[str, Tuple[float,float,float]]] = []
 
+    # Longest phrase starting at each token; hits report the index of their last token
+    id_of = _tok2id.get  # bound once for the comprehension
+    ids = tuple([id_of(t, 0) for t in toks])
+    best = [0] * n  # packed entry, 0 = no match (L is never 0)
+    for end, entry in _automaton.iter(ids):
+        start = end - (entry & 7) + 1
+        if (entry & 7) > (best[start] & 7):
+            best[start] = entry
+
+    pids: List[int] = []  # one entry per match, so repeats carry their frequency
+    add = pids.append
+
+    # Greedy left-to-right: take the longest phrase at i, then skip past it
     i = 0
     while i < n:
-        matched = False
-        first = toks[i]
-        # try longest to shortest (4 down to 1)
-        for L in range(min(_max_ngram, n - i), 0, -1):
-            if first not in _index_by_first:
-                break
-            slice_t = tuple(toks[i:i+L])
-            entry = _index_by_first[first][L].get(slice_t)
-            if entry:
-                term_key = " ".join(slice_t)
-                counts[term_key] += 1
-                matches.append((term_key, entry))
-                i += L
-                matched = True
-                break
-        if not matched:
+        entry = best[i]
+        if not entry:
             i += 1
-
-    if not matches:
-        return None
-
-    # Weighted average by match count
-    sum_w = 0
-    sum_v = sum_a = sum_d = 0.0
-    for term_key, (v,a,d) in matches:
-        c = counts[term_key]
-        sum_v += v * c
-        sum_a += a * c
-        sum_d += d * c
-        sum_w += c
-
-    if sum_w == 0:
-        return None
-    return (round(sum_v/sum_w, 4), round(sum_a/sum_w, 4), round(sum_d/sum_w, 4))
+            continue
+        add(entry >> 3)
+        i += entry & 7
+    return pids
+
+@lru_cache(maxsize=4096)
+def _vad_cached(text_norm: str) -> Tuple[Optional[Tuple[float,float,float]], float]:
+    if not text_norm:
+        return None, 0.0
+    if _automaton is None:
+        return None, 0.0
+    pids = _scan_automaton(text_norm.split())
+
+    if not pids:
+        return None, 0.0
+
+    # Mean over matches == per-phrase average weighted by match count
+    idx = np.array(pids, dtype=np.intp)
+    n = len(pids)
+    # Left-to-right sum of the gathered values (np.mean's pairwise order can flip ties at 4 decimals)
+    vad = (
+        round(sum(_V[idx].tolist()) / n, 4),
+        round(sum(_A[idx].tolist()) / n, 4),
+        round(sum(_D[idx].tolist()) / n, 4),
+    )
+    coverage = int(_L[idx].sum()) / (text_norm.count(" ") + 1)
+    return vad, coverage
 
 # VAD to Music mood conversion
 
-def music_mood_from_vad(v: float, a: float, d: float) -> Dict[str, float]:
+def _vad_to_mood_np(v: float, a: float, d: float) -> np.ndarray:
     """
-    Map psychology VAD to music mood:
+    Map psychology VAD to a music mood vector ordered as DIMS:
       - valence -> valence
       - arousal -> energy (and drives tempo_pref)
       - focus   -> higher when arousal is lower, slightly boosted by dominance
       - danceability -> mix of arousal and positive valence
       - tempo_pref -> pass arousal through (0..1); downstream can map to BPM
     """
-    valence = v
-    energy = a
-    focus = max(0.0, min(1.0, (1.0 - 0.7*a) + 0.2*d))                  # calm + confident -> focus
-    danceability = max(0.0, min(1.0, 0.35 + 0.45*a + 0.20*max(0.0, v - 0.5)))
-    tempo_pref = a  # convert to BPM later: bpm ≈ 40 + 140*tempo_pref
-    return {
-        "valence": round(valence,4),
-        "energy": round(energy,4),
-        "focus": round(focus,4),
-        "danceability": round(danceability,4),
-        "tempo_pref": round(tempo_pref,4),
-    }
+    mood = np.array([
+        v,
+        a,
+        (1.0 - 0.7*a) + 0.2*d,                        # calm + confident -> focus
+        0.35 + 0.45*a + 0.20*max(0.0, v - 0.5),
+        a,                                            # convert to BPM later: bpm ≈ 40 + 140*tempo_pref
+    ], dtype=np.float64)
+    return _round4(np.clip(mood, 0.0, 1.0))
 
 # Routes
 
+@app.on_event("startup")
+async def _start_batch_runner():
+    batch_runner.start()
+
+@app.on_event("startup")
+async def _warm():
+    load_gitlab_vad()
+    # Model load is slow; build it in a worker thread while we start serving
+    asyncio.get_running_loop().run_in_executor(None, get_pipeline)
+
 @app.get("/")
 def root():
     return {"ok": True, "service": "MoodQuiz", "endpoints": ["/ml/infer/text"]}
 
-@app.post("/ml/infer/text")
-async def infer_text(inp: TextIn) -> Dict:
-    text = (inp.text or "").strip()
+@app.post(
+    "/ml/infer/text",
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": TextIn.model_json_schema()}}}},
+)
+async def infer_text(request: Request) -> Dict:
+    # Skips Pydantic model construction for a single string field
+    try:
+        payload = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=422, detail="Request body must be valid JSON")
+    text = payload.get("text") if isinstance(payload, dict) else None
+    if not isinstance(text, str):
+        raise HTTPException(status_code=422, detail="'text' must be a string")
+    text = text.strip()
     if not text:
         return {"emotions": {}, "mood": DEFAULT_MOOD, "vad": None, "source":"default"}
 
-    #Emotion probabilities from HF model
+    # Fetching VAD from GitLab term/phrase lexicon first; it's cheap compared to the model
+    vad, coverage = vad_with_coverage(text)
+    hf_skipped = vad is not None and coverage >= VAD_COVERAGE_SKIP_HF
+
+    #Emotion probabilities from HF model, only when the lexicon signal is weak
     emotions: Dict[str, float] = {}
-    nlp = get_pipeline()
-    if nlp is not None:
+    if not hf_skipped:
         try:
-            scores = nlp(text)[0]  # list containing dictionaries[{"label": "joy", "score": 0.8}, ...]
-            emotions = { s["label"].lower(): float(s["score"]) for s in scores }
+            emotions = dict(await _emotions_for(_normalize_text(text)))
         except Exception:
             emotions = {}
 
     # Converting the emotional probabilities to mood via weighted emotion mapping
-    mood_from_emotions = {**DEFAULT_MOOD}
+    mood_from_emotions = None
     if emotions:
-        totalsum = sum(emotions.values()) or 1.0
-        agg = {k:0.0 for k in DEFAULT_MOOD.keys()}
+        probs = np.zeros(len(EMOTION_LABELS), dtype=np.float64)
         for label, prob in emotions.items():
-            mp = EMOTION_TO_MOOD.get(label)
-            if not mp:
-                continue
-            for dim, val in mp.items():
-                agg[dim] += prob * val
-        for dim in agg:
-            mood_from_emotions[dim] = round(agg[dim] / totalsum, 4)
-
-    # Fetching VAD from GitLab term/phrase lexicon
-    vad = vad_from_text_gitlab(text)
-    mood_from_vad = None
-    if vad:
-        v, a, d = vad
-        mood_from_vad = music_mood_from_vad(v, a, d)
+            idx = EMOTION_IDX.get(label)
+            if idx is not None:
+                probs[idx] = prob
+        # Normalize by all scores, including labels without a mood mapping
+        mood_from_emotions = _round4((probs @ MOOD_MATRIX) / (sum(emotions.values()) or 1.0))
+
+    mood_from_vad = _vad_to_mood_np(*vad) if vad else None
 
     # Blend the hard coded emotions with the converted VAD database word emotions
-    if mood_from_vad and emotions:
+    if mood_from_vad is not None and mood_from_emotions is not None:
         # 40% emotions, 60% VAD — tune 'wa' as you like
-        final_mood = blend_moods(mood_from_emotions, mood_from_vad, wa=0.4)
+        final_vec = _blend_np(mood_from_emotions, mood_from_vad, wa=0.4)
         source = "blend(emotions,VAD-gitlab)"
-    elif mood_from_vad:
-        final_mood = mood_from_vad
-        source = "VAD-gitlab"
-    elif emotions:
-        final_mood = mood_from_emotions
+    elif mood_from_vad is not None:
+        final_vec = mood_from_vad
+        source = "VAD-gitlab (hf-skipped)" if hf_skipped else "VAD-gitlab"
+    elif mood_from_emotions is not None:
+        final_vec = mood_from_emotions
         source = "emotions"
     else:
-        final_mood = DEFAULT_MOOD
+        final_vec = DEFAULT_VEC
         source = "default"
 
-    return {"emotions": emotions, "mood": final_mood, "vad": vad, "source": source}
+    # Only place the mood leaves vector form
+    return {"emotions": emotions, "mood": dict(zip(DIMS, final_vec.tolist())), "vad": vad, "source": source}